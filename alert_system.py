@@ -1,36 +1,224 @@
 import smtplib
+import atexit
+import queue
+import threading
+import time
+import jinja2
 import pandas as pd
+from markupsafe import Markup
 from datetime import datetime
 import streamlit as st
-from config import EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD, EMAIL_RECIPIENTS
-from utils import load_alert_log, save_alert_log
+from config import (
+    EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD, EMAIL_RECIPIENTS,
+    SMTP_MAX_MESSAGES_PER_CONNECTION, ALERT_FLUSH_INTERVAL
+)
+from utils import load_alert_log, save_alert_log, append_alert_log, clean_old_alerts, display_symbol
 from indicators import detect_crossover_signals, get_latest_signals
 
+# Signal list entries by signal type, filled with the signal's fields
+_SIGNAL_HTML = {
+    'MACD_BULLISH_CROSSOVER': Markup("<li>📈 <strong>MACD Bullish Crossover</strong><br>MACD: {value:.4f} | Signal: {signal_value:.4f}</li>"),
+    'MFI_BULLISH_CROSSOVER': Markup("<li>💰 <strong>MFI Bullish Crossover</strong><br>MFI: {value:.2f} (crossed above 50)</li>"),
+    'RSI_OVERSOLD_RECOVERY': Markup("<li>🔄 <strong>RSI Oversold Recovery</strong><br>RSI: {value:.2f} (crossed above 30)</li>")
+}
+
+# Alert email body, compiled once at import
+_ALERT_TEMPLATE = jinja2.Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True).from_string("""
+<html>
+<body>
+<h2>🚨 Stock Alert: {{ symbol }}</h2>
+<p><strong>Time:</strong> {{ now }}</p>
+<p><strong>Current Price:</strong> ₹{{ '%.2f'|format(latest['Close']) }}</p>
+
+<h3>Signals Detected:</h3>
+<ul>
+{% for item in signal_items %}
+{{ item }}
+{% endfor %}
+</ul>
+
+<h3>Current Indicator Values:</h3>
+<table border="1" style="border-collapse: collapse;">
+<tr>
+    <td><strong>Indicator</strong></td>
+    <td><strong>Value</strong></td>
+    <td><strong>Status</strong></td>
+</tr>
+{% if 'MACD' in latest %}
+<tr><td>MACD</td><td>{{ '%.4f'|format(latest['MACD']) }}</td><td>{{ 'Bullish' if latest['MACD'] > latest['MACD_Signal'] else 'Bearish' }}</td></tr>
+{% endif %}
+{% if 'RSI' in latest %}
+<tr><td>RSI</td><td>{{ '%.2f'|format(latest['RSI']) }}</td><td>{{ 'Overbought' if latest['RSI'] > 70 else 'Oversold' if latest['RSI'] < 30 else 'Neutral' }}</td></tr>
+{% endif %}
+{% if 'MFI' in latest %}
+<tr><td>MFI</td><td>{{ '%.2f'|format(latest['MFI']) }}</td><td>{{ 'Overbought' if latest['MFI'] > 80 else 'Oversold' if latest['MFI'] < 20 else 'Neutral' }}</td></tr>
+{% endif %}
+</table>
+
+<p><em>This is an automated alert from your Stock Analysis Dashboard.</em></p>
+</body>
+</html>
+""")
+
 class AlertSystem:
     def __init__(self):
         self.alert_log = load_alert_log()
+        self._alert_keys = {alert['key'] for alert in self.alert_log if 'key' in alert}
+        self._alert_df = None
+        
+        # Keys of alerts waiting on the email worker, so rescans don't queue them twice
+        self._queued_keys = set()
+        
+        # Email settings come from the environment and do not change at runtime
+        self._email_enabled = bool(EMAIL_USER and EMAIL_PASSWORD and EMAIL_RECIPIENTS)
+        
+        # New alerts are appended to the log in batches by flush_if_needed
+        self._log_lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        
+        # Persistent SMTP session reused across alerts
+        self._smtp = None
+        self._smtp_sent = 0
+        self._smtp_lock = threading.Lock()
+        atexit.register(self.close)
+        
+        # Alert emails are sent by a background worker so scans never wait on SMTP
+        self._q = queue.Queue(maxsize=256)
+        self._worker = threading.Thread(target=self._email_worker, name="alert-email-worker", daemon=True)
+        self._worker.start()
+        
+    def _get_smtp(self):
+        """Get an authenticated SMTP connection, reconnecting when needed"""
+        if self._smtp is not None:
+            # Recycle long-lived sessions before the server drops them
+            if self._smtp_sent >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+                self._close_smtp()
+            else:
+                try:
+                    self._smtp.noop()
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    self._smtp = None
+        
+        if self._smtp is None:
+            server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
+            server.starttls()
+            server.login(EMAIL_USER, EMAIL_PASSWORD)
+            self._smtp = server
+            self._smtp_sent = 0
+        
+        return self._smtp
+    
+    def _close_smtp(self):
+        """Quit the current SMTP session, ignoring errors"""
+        if self._smtp is None:
+            return
         
-    def send_email_alert(self, subject, message):
-        """Send email alert"""
         try:
-            if not EMAIL_USER or not EMAIL_PASSWORD:
-                st.warning("Email credentials not configured")
-                return False
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._smtp = None
+    
+    def close(self):
+        """Flush pending alerts and close the persistent SMTP connection"""
+        self.flush()
+        with self._smtp_lock:
+            self._close_smtp()
+    
+    def flush(self):
+        """Append alerts logged since the last flush to the alert log file"""
+        with self._log_lock:
+            if not self._pending:
+                return True
             
-            if not EMAIL_RECIPIENTS:
-                st.warning("No email recipients configured")
-                return False
+            success = append_alert_log(self._pending)
+            if success:
+                self._pending = []
+                self._last_flush = time.monotonic()
+            return success
+    
+    def flush_if_needed(self, interval=ALERT_FLUSH_INTERVAL):
+        """Flush the alert log if the last flush is older than interval seconds"""
+        if self._pending and time.monotonic() - self._last_flush >= interval:
+            return self.flush()
+        return True
+    
+    def _email_configured(self):
+        """Check email settings, warning in the UI when incomplete"""
+        if not EMAIL_USER or not EMAIL_PASSWORD:
+            st.warning("Email credentials not configured")
+            return False
+        
+        if not EMAIL_RECIPIENTS:
+            st.warning("No email recipients configured")
+            return False
+        
+        return True
+    
+    def _deliver(self, subject, message):
+        """Send an email over the persistent SMTP session"""
+        # Simple email format without MIME
+        email_message = f"Subject: {subject}\nFrom: {EMAIL_USER}\nTo: {', '.join(EMAIL_RECIPIENTS)}\nContent-Type: text/html\n\n{message}"
+        
+        with self._smtp_lock:
+            try:
+                server = self._get_smtp()
+                server.sendmail(EMAIL_USER, EMAIL_RECIPIENTS, email_message)
+            except smtplib.SMTPServerDisconnected:
+                # Session dropped between NOOP and send, retry once on a fresh one
+                self._smtp = None
+                server = self._get_smtp()
+                server.sendmail(EMAIL_USER, EMAIL_RECIPIENTS, email_message)
+            except OSError:
+                self._close_smtp()
+                raise
             
-            # Simple email format without MIME
-            email_message = f"Subject: {subject}\nFrom: {EMAIL_USER}\nTo: {', '.join(EMAIL_RECIPIENTS)}\nContent-Type: text/html\n\n{message}"
+            self._smtp_sent += 1
+    
+    def _email_worker(self):
+        """Send queued alert emails in the background"""
+        while True:
+            try:
+                subject, message, alert_records = self._q.get(timeout=ALERT_FLUSH_INTERVAL)
+            except queue.Empty:
+                self.flush_if_needed()
+                continue
             
-            server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
+            try:
+                self._deliver(subject, message)
+            except Exception as e:
+                # No Streamlit context on this thread, so log to the console, the
+                # alert stays unlogged and is retried on the next scan
+                print(f"Failed to send alert for {alert_records[0]['symbol']}: {str(e)}")
+            else:
+                self._record_alerts(alert_records)
+            finally:
+                with self._log_lock:
+                    self._queued_keys.difference_update(record['key'] for record in alert_records)
+                self._q.task_done()
             
-            server.sendmail(EMAIL_USER, EMAIL_RECIPIENTS, email_message)
-            server.quit()
+            self.flush_if_needed()
+    
+    def _record_alerts(self, alert_records):
+        """Log sent alerts, persisted on the next flush"""
+        sent_at = datetime.now().isoformat()
+        for record in alert_records:
+            record['sent_at'] = sent_at
+        
+        with self._log_lock:
+            self.alert_log.extend(alert_records)
+            self._pending.extend(alert_records)
+            self._alert_keys.update(record['key'] for record in alert_records)
+            self._alert_df = None
+    
+    def send_email_alert(self, subject, message):
+        """Send email alert"""
+        try:
+            if not self._email_configured():
+                return False
             
+            self._deliver(subject, message)
             return True
             
         except Exception as e:
@@ -42,65 +230,26 @@ class AlertSystem:
         if stock_data.empty:
             return None
         
-        latest = stock_data.iloc[-1]
-        
-        message = f"""
-        <html>
-        <body>
-        <h2>🚨 Stock Alert: {symbol.replace('.NS', '')}</h2>
-        <p><strong>Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-        <p><strong>Current Price:</strong> ₹{latest['Close']:.2f}</p>
-        
-        <h3>Signals Detected:</h3>
-        <ul>
-        """
-        
-        for signal in signals:
-            if signal['type'] == 'MACD_BULLISH_CROSSOVER':
-                message += f"<li>📈 <strong>MACD Bullish Crossover</strong><br>MACD: {signal['value']:.4f} | Signal: {signal['signal_value']:.4f}</li>"
-            elif signal['type'] == 'MFI_BULLISH_CROSSOVER':
-                message += f"<li>💰 <strong>MFI Bullish Crossover</strong><br>MFI: {signal['value']:.2f} (crossed above 50)</li>"
-            elif signal['type'] == 'RSI_OVERSOLD_RECOVERY':
-                message += f"<li>🔄 <strong>RSI Oversold Recovery</strong><br>RSI: {signal['value']:.2f} (crossed above 30)</li>"
-        
-        message += """
-        </ul>
-        
-        <h3>Current Indicator Values:</h3>
-        <table border="1" style="border-collapse: collapse;">
-        <tr>
-            <td><strong>Indicator</strong></td>
-            <td><strong>Value</strong></td>
-            <td><strong>Status</strong></td>
-        </tr>
-        """
-        
-        # Add indicator values
-        if 'MACD' in latest:
-            macd_status = "Bullish" if latest['MACD'] > latest['MACD_Signal'] else "Bearish"
-            message += f"<tr><td>MACD</td><td>{latest['MACD']:.4f}</td><td>{macd_status}</td></tr>"
-        
-        if 'RSI' in latest:
-            rsi_status = "Overbought" if latest['RSI'] > 70 else "Oversold" if latest['RSI'] < 30 else "Neutral"
-            message += f"<tr><td>RSI</td><td>{latest['RSI']:.2f}</td><td>{rsi_status}</td></tr>"
-        
-        if 'MFI' in latest:
-            mfi_status = "Overbought" if latest['MFI'] > 80 else "Oversold" if latest['MFI'] < 20 else "Neutral"
-            message += f"<tr><td>MFI</td><td>{latest['MFI']:.2f}</td><td>{mfi_status}</td></tr>"
-        
-        message += """
-        </table>
-        
-        <p><em>This is an automated alert from your Stock Analysis Dashboard.</em></p>
-        </body>
-        </html>
-        """
-        
-        return message
+        # Plain dict so the template's lookups skip pandas indexing
+        latest = stock_data.iloc[-1].to_dict()
+        
+        signal_items = [
+            _SIGNAL_HTML[signal['type']].format(**signal)
+            for signal in signals
+            if signal['type'] in _SIGNAL_HTML
+        ]
+        
+        return _ALERT_TEMPLATE.render(
+            symbol=display_symbol(symbol),
+            signal_items=signal_items,
+            latest=latest,
+            now=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        )
     
     def check_and_send_alerts(self, symbol, stock_data):
         """Check for signals and send alerts if needed"""
-        if stock_data.empty:
+        # Nothing can be sent, so skip signal checks and message building entirely
+        if not self._email_enabled or stock_data.empty:
             return False
         
         # Detect signals
@@ -112,35 +261,65 @@ class AlertSystem:
         # Check if we've already sent alerts for these signals
         latest_timestamp = stock_data.index[-1]
         
-        for signal in signals:
-            alert_key = f"{symbol}_{signal['type']}_{latest_timestamp}"
-            
-            # Check if alert already sent
-            if any(alert.get('key') == alert_key for alert in self.alert_log):
-                continue
-            
-            # Create and send alert
-            message = self.create_alert_message(symbol, [signal], stock_data)
-            subject = f"Stock Alert: {symbol.replace('.NS', '')} - {signal['type'].replace('_', ' ').title()}"
-            
-            if self.send_email_alert(subject, message):
-                # Log the alert
-                alert_record = {
-                    'key': alert_key,
-                    'symbol': symbol,
-                    'signal_type': signal['type'],
-                    'timestamp': latest_timestamp.isoformat() if hasattr(latest_timestamp, 'isoformat') else str(latest_timestamp),
-                    'sent_at': datetime.now().isoformat(),
-                    'price': stock_data['Close'].iloc[-1],
-                    'signal_value': signal['value']
-                }
-                
-                self.alert_log.append(alert_record)
-                save_alert_log(self.alert_log)
-                
-                return True
+        # Format the timestamp once, the same way the stored alert keys were built
+        key_prefix = f"{symbol}_"
+        key_suffix = f"_{latest_timestamp}"
+        timestamp = latest_timestamp.isoformat() if hasattr(latest_timestamp, 'isoformat') else str(latest_timestamp)
+        
+        # Check if alert already sent, and claim the new keys in the same step since
+        # the instance is shared by every session
+        with self._log_lock:
+            new_signals = [
+                (key_prefix + signal['type'] + key_suffix, signal)
+                for signal in signals
+                if key_prefix + signal['type'] + key_suffix not in self._alert_keys
+                and key_prefix + signal['type'] + key_suffix not in self._queued_keys
+            ]
+            self._queued_keys.update(alert_key for alert_key, _ in new_signals)
+        
+        if not new_signals:
+            return False
+        
+        # Create one alert covering every new signal on this bar
+        message = self.create_alert_message(symbol, [signal for _, signal in new_signals], stock_data)
+        signal_names = ', '.join(signal['type'].replace('_', ' ').title() for _, signal in new_signals)
+        subject = f"Stock Alert: {display_symbol(symbol)} - {signal_names}"
+        
+        price = float(stock_data['Close'].iloc[-1])
+        
+        alert_records = [
+            {
+                'key': alert_key,
+                'symbol': symbol,
+                'signal_type': signal['type'],
+                'timestamp': timestamp,
+                'price': price,
+                'signal_value': float(signal['value'])
+            }
+            for alert_key, signal in new_signals
+        ]
         
-        return False
+        # The worker logs the alerts once the email is sent
+        alert_keys = [record['key'] for record in alert_records]
+        
+        try:
+            self._q.put_nowait((subject, message, alert_records))
+        except queue.Full:
+            with self._log_lock:
+                self._queued_keys.difference_update(alert_keys)
+            st.warning("Alert queue is full, email will be retried on the next scan")
+            return False
+        
+        return True
+    
+    def _alert_frame(self):
+        """Get alert log as a DataFrame with parsed send times, rebuilt only after changes"""
+        if self._alert_df is None:
+            df = pd.DataFrame(self.alert_log, columns=['symbol', 'sent_at'])
+            df['sent_at'] = pd.to_datetime(df['sent_at'], format='ISO8601', errors='coerce', cache=True)
+            self._alert_df = df
+        
+        return self._alert_df
     
     def get_recent_alerts(self, hours=24):
         """Get recent alerts within specified hours"""
@@ -149,16 +328,10 @@ class AlertSystem:
         
         cutoff_time = datetime.now() - pd.Timedelta(hours=hours)
         
-        recent_alerts = []
-        for alert in self.alert_log:
-            try:
-                alert_time = datetime.fromisoformat(alert['sent_at'])
-                if alert_time > cutoff_time:
-                    recent_alerts.append(alert)
-            except:
-                continue
+        df = self._alert_frame()
+        recent = df[df['sent_at'] > cutoff_time].sort_values('sent_at', ascending=False, kind='stable')
         
-        return sorted(recent_alerts, key=lambda x: x['sent_at'], reverse=True)
+        return [self.alert_log[i] for i in recent.index]
     
     def get_alert_summary(self):
         """Get summary of alert activity"""
@@ -170,22 +343,14 @@ class AlertSystem:
                 'recent_alerts': []
             }
         
-        today = datetime.now().date()
-        today_alerts = 0
-        stock_counts = {}
+        df = self._alert_frame()
+        df = df[df['sent_at'].notna()]
         
-        for alert in self.alert_log:
-            try:
-                alert_date = datetime.fromisoformat(alert['sent_at']).date()
-                if alert_date == today:
-                    today_alerts += 1
-                
-                symbol = alert['symbol']
-                stock_counts[symbol] = stock_counts.get(symbol, 0) + 1
-            except:
-                continue
+        today = pd.Timestamp(datetime.now().date())
+        today_alerts = int((df['sent_at'].dt.normalize() == today).sum())
         
-        most_active_stock = max(stock_counts.items(), key=lambda x: x[1])[0] if stock_counts else None
+        stock_counts = df['symbol'].value_counts()
+        most_active_stock = stock_counts.idxmax() if not stock_counts.empty else None
         
         return {
             'total_alerts': len(self.alert_log),
@@ -214,7 +379,28 @@ class AlertSystem:
             st.error(f"Email test failed: {str(e)}")
             return False
     
+    def clean_old_alerts(self, days=7):
+        """Clean alerts older than specified days from the log file and memory"""
+        with self._log_lock:
+            # Persist pending alerts first so the rewrite keeps them
+            if self._pending and append_alert_log(self._pending):
+                self._pending = []
+                self._last_flush = time.monotonic()
+            
+            dropped = clean_old_alerts(days)
+            
+            if dropped:
+                self.alert_log = load_alert_log() + self._pending
+                self._alert_keys = {alert['key'] for alert in self.alert_log if 'key' in alert}
+                self._alert_df = None
+            
+            return dropped
+    
     def clear_alert_log(self):
         """Clear all alerts from log"""
-        self.alert_log = []
-        return save_alert_log(self.alert_log)
+        with self._log_lock:
+            self.alert_log = []
+            self._alert_keys.clear()
+            self._alert_df = None
+            self._pending = []
+            return save_alert_log(self.alert_log)
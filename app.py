@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 import plotly.subplots as sp
 from datetime import datetime, timedelta
@@ -11,7 +12,8 @@ from alert_system import AlertSystem
 from indicators import get_latest_signals, get_indicator_summary
 from utils import (
     load_stock_data, format_number, format_percentage, get_color_for_value,
-    validate_email_config, get_stock_status_summary, clean_old_alerts
+    validate_email_config, get_stock_status_summary, display_symbol,
+    load_many_stocks, stock_file_mtime
 )
 
 # Page configuration
@@ -22,12 +24,17 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def get_alert_system():
+    """Get the alert system shared by every session, so its email worker and SMTP session exist once"""
+    return AlertSystem()
+
 # Initialize session state
 if 'data_manager' not in st.session_state:
     st.session_state.data_manager = DataManager()
 
 if 'alert_system' not in st.session_state:
-    st.session_state.alert_system = AlertSystem()
+    st.session_state.alert_system = get_alert_system()
 
 if 'auto_refresh' not in st.session_state:
     st.session_state.auto_refresh = False
@@ -35,11 +42,29 @@ if 'auto_refresh' not in st.session_state:
 if 'last_scan_time' not in st.session_state:
     st.session_state.last_scan_time = None
 
-def create_stock_chart(symbol, df):
+def _frame_key(df):
+    """Identify a stock frame by its shape and last bar for caching"""
+    return (len(df), df.index[-1] if len(df) else None, tuple(df.columns))
+
+# mtime_ns is part of the key so rewritten bars and recalculated indicators are never stale
+@st.cache_data(show_spinner=False, max_entries=256, hash_funcs={pd.DataFrame: _frame_key})
+def cached_latest_signals(symbol, df, mtime_ns):
+    """Get latest signals for a stock, cached per symbol, file version and last bar"""
+    return get_latest_signals(df)
+
+@st.cache_data(show_spinner=False, max_entries=256, hash_funcs={pd.DataFrame: _frame_key})
+def cached_indicator_summary(symbol, df, mtime_ns):
+    """Get indicator summary for a stock, cached per symbol, file version and last bar"""
+    return get_indicator_summary(df)
+
+def create_stock_chart(symbol, df, window=500):
     """Create comprehensive stock chart with all indicators"""
     if df.empty:
         return None
     
+    # Only plot the most recent bars, older history is rarely looked at
+    df_plot = df.iloc[-window:]
+    
     # Create subplots
     fig = sp.make_subplots(
         rows=4, cols=1,
@@ -47,7 +72,7 @@ def create_stock_chart(symbol, df):
         vertical_spacing=0.05,
         row_heights=[0.4, 0.2, 0.2, 0.2],
         subplot_titles=(
-            f'{symbol.replace(".NS", "")} - Price & Volume',
+            f'{display_symbol(symbol)} - Price & Volume',
             'MACD',
             'RSI',
             'MFI'
@@ -57,24 +82,23 @@ def create_stock_chart(symbol, df):
     # Price and Volume
     fig.add_trace(
         go.Candlestick(
-            x=df.index,
-            open=df['Open'],
-            high=df['High'],
-            low=df['Low'],
-            close=df['Close'],
+            x=df_plot.index,
+            open=df_plot['Open'],
+            high=df_plot['High'],
+            low=df_plot['Low'],
+            close=df_plot['Close'],
             name='Price'
         ),
         row=1, col=1
     )
     
     # Volume bars
-    colors = ['red' if df['Close'].iloc[i] < df['Open'].iloc[i] else 'green' 
-              for i in range(len(df))]
+    colors = np.where(df_plot['Close'].values < df_plot['Open'].values, 'red', 'green')
     
     fig.add_trace(
         go.Bar(
-            x=df.index,
-            y=df['Volume'],
+            x=df_plot.index,
+            y=df_plot['Volume'],
             name='Volume',
             marker_color=colors,
             opacity=0.7,
@@ -84,11 +108,11 @@ def create_stock_chart(symbol, df):
     )
     
     # MACD
-    if 'MACD' in df.columns:
+    if 'MACD' in df_plot.columns:
         fig.add_trace(
             go.Scatter(
-                x=df.index,
-                y=df['MACD'],
+                x=df_plot.index,
+                y=df_plot['MACD'],
                 name='MACD',
                 line=dict(color='blue')
             ),
@@ -97,8 +121,8 @@ def create_stock_chart(symbol, df):
         
         fig.add_trace(
             go.Scatter(
-                x=df.index,
-                y=df['MACD_Signal'],
+                x=df_plot.index,
+                y=df_plot['MACD_Signal'],
                 name='Signal',
                 line=dict(color='red')
             ),
@@ -107,8 +131,8 @@ def create_stock_chart(symbol, df):
         
         fig.add_trace(
             go.Bar(
-                x=df.index,
-                y=df['MACD_Histogram'],
+                x=df_plot.index,
+                y=df_plot['MACD_Histogram'],
                 name='Histogram',
                 marker_color='gray',
                 opacity=0.6
@@ -117,11 +141,11 @@ def create_stock_chart(symbol, df):
         )
     
     # RSI
-    if 'RSI' in df.columns:
+    if 'RSI' in df_plot.columns:
         fig.add_trace(
             go.Scatter(
-                x=df.index,
-                y=df['RSI'],
+                x=df_plot.index,
+                y=df_plot['RSI'],
                 name='RSI',
                 line=dict(color='purple')
             ),
@@ -134,11 +158,11 @@ def create_stock_chart(symbol, df):
         fig.add_hline(y=50, line_dash="dot", line_color="gray", row=3, col=1)
     
     # MFI
-    if 'MFI' in df.columns:
+    if 'MFI' in df_plot.columns:
         fig.add_trace(
             go.Scatter(
-                x=df.index,
-                y=df['MFI'],
+                x=df_plot.index,
+                y=df_plot['MFI'],
                 name='MFI',
                 line=dict(color='orange')
             ),
@@ -153,7 +177,7 @@ def create_stock_chart(symbol, df):
     # Update layout
     fig.update_layout(
         height=800,
-        title=f"{symbol.replace('.NS', '')} - Technical Analysis",
+        title=f"{display_symbol(symbol)} - Technical Analysis",
         xaxis_rangeslider_visible=False,
         showlegend=True
     )
@@ -173,7 +197,7 @@ def display_stock_metrics(symbol, df):
         st.warning(f"No data available for {symbol}")
         return
     
-    summary = get_indicator_summary(df)
+    summary = cached_indicator_summary(symbol, df, stock_file_mtime(symbol))
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -218,21 +242,25 @@ def scan_for_signals():
     with st.spinner("Scanning for signals..."):
         signals_found = []
         
-        for symbol in NIFTY_100_SYMBOLS:
-            df = load_stock_data(symbol)
-            if not df.empty:
-                signals = get_latest_signals(df)
+        # Disk reads run in parallel, cached signal checks and alerts stay on the
+        # script thread where Streamlit calls work
+        for symbol, df in load_many_stocks(NIFTY_100_SYMBOLS).items():
+            if df.empty:
+                continue
+            
+            signals = cached_latest_signals(symbol, df, stock_file_mtime(symbol))
+            
+            if signals['macd_crossover'] or signals['mfi_crossover']:
+                signals_found.append({
+                    'symbol': symbol,
+                    'signals': signals
+                })
                 
-                if signals['macd_crossover'] or signals['mfi_crossover']:
-                    signals_found.append({
-                        'symbol': symbol,
-                        'signals': signals
-                    })
-                    
-                    # Send alert
-                    st.session_state.alert_system.check_and_send_alerts(symbol, df)
+                # Send alert
+                st.session_state.alert_system.check_and_send_alerts(symbol, df)
         
         st.session_state.last_scan_time = datetime.now()
+        st.session_state.alert_system.flush_if_needed()
         
         if signals_found:
             st.success(f"Found {len(signals_found)} stocks with active signals!")
@@ -247,10 +275,37 @@ def scan_for_signals():
                 if signals['mfi_crossover']:
                     signal_types.append("MFI Crossover")
                 
-                st.info(f"🚨 {symbol.replace('.NS', '')}: {', '.join(signal_types)}")
+                st.info(f"🚨 {display_symbol(symbol)}: {', '.join(signal_types)}")
         else:
             st.info("No active signals detected in current scan.")
 
+def build_market_overview(symbols):
+    """Build market summary table for the given stocks"""
+    stock_frames = {symbol: df for symbol, df in load_many_stocks(symbols).items() if not df.empty}
+    
+    if not stock_frames:
+        return pd.DataFrame()
+    
+    # Last two bars of every stock in one frame, summarized with vectorized column ops
+    tails = pd.concat({symbol: df.iloc[-2:] for symbol, df in stock_frames.items()})
+    grouped = tails.groupby(level=0, sort=False)
+    
+    columns = ['Close', 'MACD', 'MACD_Signal', 'RSI', 'MFI', 'Volume_Surge']
+    latest = grouped.nth(-1).droplevel(1).reindex(columns=columns)
+    previous_close = grouped['Close'].nth(0).droplevel(1)
+    
+    market_df = pd.DataFrame({
+        'Stock': latest.index.str.removesuffix('.NS'),
+        'Price': latest['Close'].to_numpy(),
+        'Change %': ((latest['Close'] - previous_close) / previous_close * 100).round(2).to_numpy(),
+        'MACD': np.where(latest['MACD'] > latest['MACD_Signal'], 'Bullish', 'Bearish'),
+        'RSI': latest['RSI'].round(2).to_numpy(),
+        'MFI': latest['MFI'].round(2).to_numpy(),
+        'Volume Surge': np.where(latest['Volume_Surge'].fillna(0).astype(bool), 'Yes', 'No')
+    })
+    
+    return market_df
+
 def main():
     """Main application"""
     st.title("📈 Nifty 100 Stock Analysis Dashboard")
@@ -266,13 +321,21 @@ def main():
         if st.button("📥 Download All Historical Data"):
             with st.spinner("Downloading historical data..."):
                 success, failed = st.session_state.data_manager.download_all_historical_data()
+                st.session_state.pop('market_overview', None)
                 st.success(f"Download complete! Success: {success}, Failed: {failed}")
         
         if st.button("🔄 Update Current Data"):
             with st.spinner("Updating current data..."):
                 success, failed = st.session_state.data_manager.update_all_current_data()
+                st.session_state.pop('market_overview', None)
                 st.success(f"Update complete! Success: {success}, Failed: {failed}")
         
+        if st.button("🧮 Recalculate Indicators"):
+            with st.spinner("Recalculating indicators..."):
+                success, failed = st.session_state.data_manager.recalculate_all_indicators()
+                st.session_state.pop('market_overview', None)
+                st.success(f"Recalculation complete! Success: {success}, Failed: {failed}")
+        
         # Alert System
         st.subheader("Alert System")
         
@@ -327,7 +390,7 @@ def main():
             st.subheader("🚨 Recent Alerts (Last 6 hours)")
             
             for alert in recent_alerts[:5]:  # Show last 5
-                with st.expander(f"{alert['symbol'].replace('.NS', '')} - {alert['signal_type'].replace('_', ' ').title()}", expanded=False):
+                with st.expander(f"{display_symbol(alert['symbol'])} - {alert['signal_type'].replace('_', ' ').title()}", expanded=False):
                     col1, col2, col3 = st.columns(3)
                     with col1:
                         st.write(f"**Time:** {alert['sent_at'][:19]}")
@@ -346,7 +409,7 @@ def main():
         for symbol in NIFTY_100_SYMBOLS[:20]:  # Check first 20 for performance
             df = load_stock_data(symbol)
             if not df.empty:
-                signals = get_latest_signals(df)
+                signals = cached_latest_signals(symbol, df, stock_file_mtime(symbol))
                 
                 if signals['macd_crossover']:
                     signal_summary["MACD Bullish"] += 1
@@ -375,7 +438,7 @@ def main():
         selected_stock = st.selectbox(
             "Select Stock for Analysis",
             NIFTY_100_SYMBOLS,
-            format_func=lambda x: x.replace('.NS', ''),
+            format_func=display_symbol,
             key="stock_selector"
         )
         
@@ -389,7 +452,18 @@ def main():
                 st.markdown("---")
                 
                 # Display chart
-                chart = create_stock_chart(selected_stock, df)
+                chart_window = len(df)
+                if len(df) > 100:
+                    chart_window = st.slider(
+                        "Bars to display",
+                        min_value=100,
+                        max_value=len(df),
+                        value=min(500, len(df)),
+                        step=50,
+                        key="chart_window"
+                    )
+                
+                chart = create_stock_chart(selected_stock, df, window=chart_window)
                 if chart:
                     st.plotly_chart(chart, use_container_width=True)
                 
@@ -422,7 +496,7 @@ def main():
             st.metric("Today's Alerts", alert_summary['today_alerts'])
         with col3:
             if alert_summary['most_active_stock']:
-                st.metric("Most Active Stock", alert_summary['most_active_stock'].replace('.NS', ''))
+                st.metric("Most Active Stock", display_symbol(alert_summary['most_active_stock']))
         
         st.markdown("---")
         
@@ -434,7 +508,7 @@ def main():
         if recent_alerts:
             alert_df = pd.DataFrame(recent_alerts)
             alert_df['sent_at'] = pd.to_datetime(alert_df['sent_at']).dt.strftime('%Y-%m-%d %H:%M')
-            alert_df['symbol'] = alert_df['symbol'].str.replace('.NS', '')
+            alert_df['symbol'] = alert_df['symbol'].str.removesuffix('.NS')
             alert_df['signal_type'] = alert_df['signal_type'].str.replace('_', ' ').str.title()
             
             st.dataframe(
@@ -462,7 +536,7 @@ def main():
         
         with col2:
             if st.button("🗑️ Clean Old Alerts"):
-                cleaned = clean_old_alerts(7)  # Clean alerts older than 7 days
+                cleaned = st.session_state.alert_system.clean_old_alerts(7)  # Clean alerts older than 7 days
                 st.success(f"Cleaned {cleaned} old alerts")
                 st.rerun()
     
@@ -472,37 +546,14 @@ def main():
         # Market summary
         st.subheader("Nifty 100 Market Summary")
         
-        # Get data for all stocks
-        market_data = []
+        # The 50-stock scan only runs on first view or on request, not on every rerun
+        if st.button("🔄 Refresh Market Overview") or 'market_overview' not in st.session_state:
+            with st.spinner("Loading market overview..."):
+                st.session_state.market_overview = build_market_overview(NIFTY_100_SYMBOLS[:50])  # First 50 for performance
         
-        progress_bar = st.progress(0)
+        market_df = st.session_state.market_overview
         
-        for i, symbol in enumerate(NIFTY_100_SYMBOLS[:50]):  # First 50 for performance
-            df = load_stock_data(symbol)
-            
-            if not df.empty:
-                summary = get_indicator_summary(df)
-                
-                market_data.append({
-                    'Stock': symbol.replace('.NS', ''),
-                    'Price': summary['price']['current'],
-                    'Change %': summary['price']['change_pct'],
-                    'MACD': 'Bullish' if summary['macd']['bullish'] else 'Bearish',
-                    'RSI': summary['rsi']['value'],
-                    'MFI': summary['mfi']['value'],
-                    'Volume Surge': 'Yes' if summary['volume']['surge'] else 'No'
-                })
-            
-            progress_bar.progress((i + 1) / 50)
-        
-        if market_data:
-            market_df = pd.DataFrame(market_data)
-            
-            # Format the dataframe
-            market_df['Change %'] = market_df['Change %'].round(2)
-            market_df['RSI'] = market_df['RSI'].round(2)
-            market_df['MFI'] = market_df['MFI'].round(2)
-            
+        if not market_df.empty:
             st.dataframe(market_df, use_container_width=True)
             
             # Market statistics
@@ -17,6 +17,7 @@ RSI_PERIOD = 14
 MFI_PERIOD = 14
 VOLUME_MA_SHORT = 20
 VOLUME_MA_LONG = 50
+INDICATOR_LOOKBACK = max(RSI_PERIOD, MFI_PERIOD, VOLUME_MA_LONG) + 2  # bars the rolling windows need before new bars on updates
 
 # Data configuration
 DATA_FOLDER = "stock_data"
@@ -26,14 +27,21 @@ HISTORICAL_PERIOD = "6mo"  # 6 months of historical data
 # Email configuration
 EMAIL_HOST = "smtp.gmail.com"
 EMAIL_PORT = 587
+SMTP_MAX_MESSAGES_PER_CONNECTION = 50  # recycle the SMTP session after this many emails
+
+# Alert log configuration
+ALERT_FLUSH_INTERVAL = 2.0  # seconds between alert log writes
 
 # API rate limiting
-REQUEST_DELAY = 0.5  # seconds between requests
+REQUEST_RATE = 8  # requests per second once the burst is used up
+REQUEST_BURST = 16  # requests allowed back to back
+RATE_LIMIT_RETRIES = 3  # retries after an HTTP 429 before giving up
 BATCH_SIZE = 10  # number of stocks to process in each batch
 
 # Dashboard configuration
 REFRESH_INTERVAL = 60  # seconds
 MAX_CHARTS_PER_PAGE = 6
+MAX_WORKERS = 16  # threads used to load and download stock data in parallel
 
 # Environment variables
 EMAIL_USER = os.getenv("EMAIL_USER", "")
@@ -1,62 +1,155 @@
+import os
+import multiprocessing
 import yfinance as yf
 import pandas as pd
 import streamlit as st
-import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
-from config import NIFTY_100_SYMBOLS, HISTORICAL_PERIOD, REQUEST_DELAY, BATCH_SIZE
-from utils import save_stock_data, load_stock_data, rate_limit_delay, create_data_folder
-from indicators import calculate_all_indicators
+from config import NIFTY_100_SYMBOLS, HISTORICAL_PERIOD, BATCH_SIZE, MAX_WORKERS
+from utils import save_stock_data, load_stock_data, load_stock_index, rebuild_stock_index, resample_ohlcv, rate_limited_request, is_no_data_error, create_data_folder
+from indicators import calculate_all_indicators, calculate_indicators_batch
+
+def _recompute_indicators(symbol):
+    """Recalculate and save indicators for one stock, runs in a worker process"""
+    df = load_stock_data(symbol)
+    if df.empty:
+        return False
+    
+    # The parent process owns the stock index, workers only write their own file
+    return save_stock_data(symbol, calculate_all_indicators(df), update_index=False)
+
+def _batch_failed(data, batch):
+    """Whether a yf.download response has no bars for any stock of the batch, as after a throttled request"""
+    if data.empty:
+        return True
+    
+    # Single-ticker downloads come back without the ticker column level
+    if not isinstance(data.columns, pd.MultiIndex):
+        return len(batch) > 1
+    
+    # Gaps for single stocks are left to the per-stock fallback
+    tickers = set(data.columns.get_level_values(0))
+    return all(symbol not in tickers or data[symbol].isna().all().all() for symbol in batch)
 
 class DataManager:
     def __init__(self):
         create_data_folder()
         self.last_update = {}
+    
+    def _report_error(self, message, errors=None, warning=False):
+        """Collect a message for display after a parallel run, or show it right away"""
+        if errors is not None:
+            errors.append(message)
+        elif warning:
+            st.warning(message)
+        else:
+            st.error(message)
+    
+    def _show_errors(self, errors):
+        """Show the messages collected during a parallel run in a single box"""
+        if errors:
+            st.error("\n".join(f"- {message}" for message in errors))
         
-    def download_historical_data(self, symbol, progress_callback=None):
+    def download_historical_data(self, symbol, progress_callback=None, errors=None):
         """Download historical data for a single stock"""
         try:
-            # Rate limiting
-            rate_limit_delay()
-            
-            # Download data
+            # Download data, raise_errors surfaces HTTP 429 so the rate limiter can back off
             ticker = yf.Ticker(symbol)
-            df = ticker.history(period=HISTORICAL_PERIOD, interval="1h")
+            df = rate_limited_request(ticker.history, period=HISTORICAL_PERIOD, interval="1h", raise_errors=True)
             
             if df.empty:
-                st.warning(f"No data available for {symbol}")
+                self._report_error(f"No data available for {symbol}", errors, warning=True)
                 return False
             
-            # Resample to 4-hour data
-            df_4h = df.resample('4H').agg({
-                'Open': 'first',
-                'High': 'max',
-                'Low': 'min',
-                'Close': 'last',
-                'Volume': 'sum'
-            }).dropna()
-            
-            # Calculate indicators
-            df_4h = calculate_all_indicators(df_4h)
-            
-            # Save data
-            success = save_stock_data(symbol, df_4h)
-            
-            if success:
-                self.last_update[symbol] = datetime.now()
-                if progress_callback:
-                    progress_callback(symbol, True)
-                return True
-            else:
-                if progress_callback:
-                    progress_callback(symbol, False)
-                return False
+            return self._process_history(symbol, df, progress_callback, errors)
                 
         except Exception as e:
-            st.error(f"Error downloading data for {symbol}: {str(e)}")
+            # raise_errors also raises when there is simply no data, which stays a warning
+            if is_no_data_error(e):
+                self._report_error(f"No data available for {symbol}", errors, warning=True)
+            else:
+                self._report_error(f"Error downloading data for {symbol}: {str(e)}", errors)
             if progress_callback:
                 progress_callback(symbol, False)
             return False
     
+    def _process_history(self, symbol, df, progress_callback=None, errors=None):
+        """Resample hourly history to 4-hour bars, add indicators and save"""
+        # Calculate indicators
+        df_4h = calculate_all_indicators(resample_ohlcv(df))
+        
+        return self._save_history(symbol, df_4h, progress_callback, errors)
+    
+    def _save_history(self, symbol, df_4h, progress_callback=None, errors=None):
+        """Save 4-hour bars and record the update"""
+        success = save_stock_data(symbol, df_4h, errors=errors)
+        
+        if success:
+            self.last_update[symbol] = datetime.now()
+        if progress_callback:
+            progress_callback(symbol, success)
+        return success
+    
+    def download_batch_historical_data(self, batch, progress_callback=None, errors=None):
+        """Download historical data for several stocks in one request"""
+        try:
+            # One multi-ticker request instead of one per stock, adjusted like Ticker.history
+            # so batch, fallback and update bars line up
+            data = rate_limited_request(
+                yf.download,
+                tickers=batch,
+                period=HISTORICAL_PERIOD,
+                interval="1h",
+                group_by='ticker',
+                auto_adjust=True,
+                threads=True,
+                progress=False,
+                retry_if=lambda data: _batch_failed(data, batch)
+            )
+        except Exception as e:
+            self._report_error(f"Error downloading data for {', '.join(batch)}: {str(e)}", errors)
+            data = pd.DataFrame()
+        
+        results = {}
+        bars = {}
+        
+        for symbol in batch:
+            try:
+                # Single-ticker downloads come back without the ticker column level
+                if isinstance(data.columns, pd.MultiIndex):
+                    df = data[symbol].dropna(how='all')
+                elif len(batch) == 1:
+                    df = data.dropna(how='all')
+                else:
+                    raise KeyError(symbol)
+                
+                if df.empty:
+                    raise KeyError(symbol)
+            except KeyError:
+                # Missing from the batch response, fall back to a single-stock request
+                results[symbol] = self.download_historical_data(symbol, progress_callback, errors)
+                continue
+            
+            try:
+                bars[symbol] = resample_ohlcv(df)
+            except Exception as e:
+                self._report_error(f"Error processing data for {symbol}: {str(e)}", errors)
+                results[symbol] = False
+                if progress_callback:
+                    progress_callback(symbol, False)
+        
+        # Indicators for the whole batch in one vectorized pass
+        for symbol, df_4h in calculate_indicators_batch(bars).items():
+            try:
+                results[symbol] = self._save_history(symbol, df_4h, progress_callback, errors)
+            except Exception as e:
+                self._report_error(f"Error saving data for {symbol}: {str(e)}", errors)
+                results[symbol] = False
+                if progress_callback:
+                    progress_callback(symbol, False)
+        
+        return results
+    
     def download_all_historical_data(self):
         """Download historical data for all Nifty 100 stocks"""
         st.info("Starting historical data download for all Nifty 100 stocks...")
@@ -79,27 +172,28 @@ class DataManager:
             progress_bar.progress(progress)
             status_text.text(f"Processed: {total_processed}/{len(NIFTY_100_SYMBOLS)} | Success: {successful} | Failed: {failed}")
         
-        # Process stocks in batches
-        for i in range(0, len(NIFTY_100_SYMBOLS), BATCH_SIZE):
-            batch = NIFTY_100_SYMBOLS[i:i+BATCH_SIZE]
-            
-            for symbol in batch:
-                self.download_historical_data(symbol, update_progress)
-            
-            # Longer delay between batches
-            if i + BATCH_SIZE < len(NIFTY_100_SYMBOLS):
-                time.sleep(2)
+        # Batches run one after another, yf.download in yfinance 0.2.18 keeps its results
+        # in shared module state, threads=True already fetches each batch's tickers in parallel
+        batches = [NIFTY_100_SYMBOLS[i:i+BATCH_SIZE] for i in range(0, len(NIFTY_100_SYMBOLS), BATCH_SIZE)]
+        
+        # Errors are collected and shown once at the end instead of one box per stock
+        errors = []
+        
+        for batch in batches:
+            for symbol, success in self.download_batch_historical_data(batch, None, errors).items():
+                update_progress(symbol, success)
         
         progress_bar.progress(1.0)
         status_text.text(f"Download complete! Success: {successful} | Failed: {failed}")
+        self._show_errors(errors)
         
         return successful, failed
     
-    def update_current_data(self, symbol):
+    def update_current_data(self, symbol, errors=None):
         """Update current data for a single stock"""
         try:
             # Load existing data
-            df = load_stock_data(symbol)
+            df = load_stock_data(symbol, errors)
             
             if df.empty:
                 return False
@@ -108,37 +202,29 @@ class DataManager:
             last_timestamp = df.index[-1]
             
             # Only update if data is older than 4 hours
-            if datetime.now() - last_timestamp.to_pydatetime() < timedelta(hours=4):
+            # Bars keep the exchange time zone, so take now in the same zone
+            if pd.Timestamp.now(tz=last_timestamp.tz) - last_timestamp < timedelta(hours=4):
                 return True
             
-            # Rate limiting
-            rate_limit_delay()
-            
             # Download recent data
             ticker = yf.Ticker(symbol)
-            recent_df = ticker.history(period="5d", interval="1h")
+            recent_df = rate_limited_request(ticker.history, period="5d", interval="1h", raise_errors=True)
             
             if recent_df.empty:
                 return False
             
             # Resample to 4-hour data
-            recent_4h = recent_df.resample('4H').agg({
-                'Open': 'first',
-                'High': 'max',
-                'Low': 'min',
-                'Close': 'last',
-                'Volume': 'sum'
-            }).dropna()
+            recent_4h = resample_ohlcv(recent_df)
             
-            # Merge with existing data
-            combined_df = pd.concat([df, recent_4h[recent_4h.index > last_timestamp]])
-            combined_df = combined_df[~combined_df.index.duplicated(keep='last')]
+            # Merge with existing data, bars are sorted so only those after the last stored bar are appended
+            new_rows = recent_4h.iloc[recent_4h.index.searchsorted(last_timestamp, side='right'):]
+            combined_df = pd.concat([df, new_rows])
             
-            # Recalculate indicators
-            combined_df = calculate_all_indicators(combined_df)
+            # Calculate indicators for the new bars only
+            combined_df = calculate_all_indicators(combined_df, tail_only=True)
             
             # Save updated data
-            success = save_stock_data(symbol, combined_df)
+            success = save_stock_data(symbol, combined_df, errors=errors)
             
             if success:
                 self.last_update[symbol] = datetime.now()
@@ -146,30 +232,45 @@ class DataManager:
             return success
             
         except Exception as e:
-            st.error(f"Error updating data for {symbol}: {str(e)}")
+            # No recent bars is not an error, same as an empty history
+            if not is_no_data_error(e):
+                self._report_error(f"Error updating data for {symbol}: {str(e)}", errors)
             return False
     
     def update_all_current_data(self):
         """Update current data for all stocks"""
-        successful = 0
-        failed = 0
+        errors = []
         
-        for symbol in NIFTY_100_SYMBOLS:
-            if self.update_current_data(symbol):
-                successful += 1
-            else:
-                failed += 1
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = list(executor.map(lambda symbol: self.update_current_data(symbol, errors), NIFTY_100_SYMBOLS))
+        
+        self._show_errors(errors)
+        
+        successful = sum(1 for success in results if success)
+        failed = len(results) - successful
+        
+        return successful, failed
+    
+    def recalculate_all_indicators(self):
+        """Recalculate indicators for all stocks from saved data across CPU cores"""
+        # Spawned workers avoid forking a process that is running Streamlit and SMTP threads
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(_recompute_indicators, NIFTY_100_SYMBOLS, chunksize=4))
+        
+        rebuild_stock_index()
+        
+        successful = sum(1 for success in results if success)
+        failed = len(results) - successful
         
         return successful, failed
     
     def get_data_status(self):
         """Get status of all stock data"""
         status = {}
+        index = load_stock_index()
         
         for symbol in NIFTY_100_SYMBOLS:
-            df = load_stock_data(symbol)
-            
-            if df.empty:
+            if symbol not in index.index:
                 status[symbol] = {
                     'status': 'No Data',
                     'last_update': None,
@@ -178,8 +279,8 @@ class DataManager:
             else:
                 status[symbol] = {
                     'status': 'Available',
-                    'last_update': df.index[-1],
-                    'records': len(df)
+                    'last_update': index.at[symbol, 'last_ts'],
+                    'records': int(index.at[symbol, 'records'])
                 }
         
         return status
@@ -206,12 +307,13 @@ class DataManager:
         """Get latest prices for all stocks"""
         prices = {}
         
+        index = load_stock_index()
+        
         for symbol in NIFTY_100_SYMBOLS:
-            df = load_stock_data(symbol)
-            if not df.empty:
+            if symbol in index.index:
                 prices[symbol] = {
-                    'price': df['Close'].iloc[-1],
-                    'timestamp': df.index[-1]
+                    'price': index.at[symbol, 'last_close'],
+                    'timestamp': index.at[symbol, 'last_ts']
                 }
         
         return prices
@@ -219,16 +321,14 @@ class DataManager:
     def check_data_freshness(self):
         """Check how fresh the data is for all stocks"""
         freshness = {}
-        now = datetime.now()
+        index = load_stock_index()
         
         for symbol in NIFTY_100_SYMBOLS:
-            df = load_stock_data(symbol)
-            
-            if df.empty:
+            if symbol not in index.index:
                 freshness[symbol] = 'No Data'
             else:
-                last_update = df.index[-1].to_pydatetime()
-                hours_old = (now - last_update).total_seconds() / 3600
+                last_update = index.at[symbol, 'last_ts']
+                hours_old = (pd.Timestamp.now(tz=last_update.tz) - last_update).total_seconds() / 3600
                 
                 if hours_old < 4:
                     freshness[symbol] = 'Fresh'
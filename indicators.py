@@ -1,35 +1,141 @@
 import pandas as pd
 import numpy as np
-from config import MACD_FAST, MACD_SLOW, MACD_SIGNAL, RSI_PERIOD, MFI_PERIOD, VOLUME_MA_SHORT, VOLUME_MA_LONG
+try:
+    import bottleneck as bn
+except ImportError:
+    bn = None
+from config import MACD_FAST, MACD_SLOW, MACD_SIGNAL, RSI_PERIOD, MFI_PERIOD, VOLUME_MA_SHORT, VOLUME_MA_LONG, INDICATOR_LOOKBACK
+
+def _ema(values, span, seed=None):
+    """Exponential moving average of a 1-D array or a 2-D (bars x symbols) array, optionally continuing from seed"""
+    if seed is not None:
+        # The adjust=False recurrence only needs the previous EMA value to carry on
+        return _ema(np.concatenate([[seed], values]), span)[1:]
+    return pd.DataFrame(values).ewm(span=span, adjust=False).mean().to_numpy().reshape(values.shape)
+
+def _rolling_mean(values, window):
+    """Rolling mean along the bar axis"""
+    return pd.DataFrame(values).rolling(window=window).mean().to_numpy().reshape(values.shape)
+
+def _rolling_sum(values, window):
+    """Rolling sum along the bar axis"""
+    return pd.DataFrame(values).rolling(window=window).sum().to_numpy().reshape(values.shape)
+
+def _rolling_pair(first, second, window, how='mean'):
+    """Rolling mean or sum of two same-shaped arrays, in a single window pass for 1-D input"""
+    rolling = _rolling_mean if how == 'mean' else _rolling_sum
+    if first.ndim > 1:
+        # Batch grids are already wide, stacking them costs more than a second pass
+        return rolling(first, window), rolling(second, window)
+    
+    # Both series become the two columns of one frame, so pandas walks the window once
+    rolled = getattr(pd.DataFrame(np.column_stack([first, second])).rolling(window=window), how)().to_numpy()
+    return rolled[:, 0], rolled[:, 1]
+
+def _move_mean(values, window):
+    """Rolling mean via bottleneck when installed, for series where float drift is harmless"""
+    if bn is None or len(values) < window:
+        return _rolling_mean(values, window)
+    return bn.move_mean(values, window=window, min_count=window, axis=0)
+
+def _shift(values):
+    """Shift one bar forward, NaN-filling the first bar"""
+    shifted = np.empty_like(values)
+    shifted[:1] = np.nan
+    shifted[1:] = values[:-1]
+    return shifted
+
+def _diff(values):
+    """One-bar difference, NaN on the first bar"""
+    return values - _shift(values)
+
+def _macd_columns(close, state=None):
+    """MACD line, signal, histogram and crossover flag, continuing the EMAs from a previous bar's state if given"""
+    if state is None:
+        state = {}
+    
+    ema_fast = _ema(close, MACD_FAST, state.get('EMA_Fast'))
+    ema_slow = _ema(close, MACD_SLOW, state.get('EMA_Slow'))
+    macd_line = ema_fast - ema_slow
+    signal_line = _ema(macd_line, MACD_SIGNAL, state.get('MACD_Signal'))
+    
+    crossover = (macd_line > signal_line) & (_shift(macd_line) <= _shift(signal_line))
+    
+    # The EMAs are stored so incremental updates can resume them
+    return {
+        'EMA_Fast': ema_fast,
+        'EMA_Slow': ema_slow,
+        'MACD': macd_line,
+        'MACD_Signal': signal_line,
+        'MACD_Histogram': macd_line - signal_line,
+        'MACD_Crossover': crossover.astype(np.int64)
+    }
+
+def _rsi_columns(close):
+    """RSI from rolling average gains and losses"""
+    delta = _diff(close)
+    
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = np.where(delta < 0, -delta, 0.0)
+    
+    # Bars without a price (batch padding) stay NaN instead of counting as flat
+    no_price = np.isnan(close)
+    gain[no_price] = np.nan
+    loss[no_price] = np.nan
+    
+    avg_gain, avg_loss = _rolling_pair(gain, loss, RSI_PERIOD)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - (100 / (1 + avg_gain / avg_loss))
+    
+    # Oversold recovery (crossing back above 30)
+    recovery = (rsi > 30) & (_shift(rsi) <= 30)
+    
+    return {'RSI': rsi, 'RSI_OS_Recovery': recovery.astype(np.int64)}
+
+def _mfi_columns(high, low, close, volume):
+    """Money Flow Index and 50-line crossover flag"""
+    typical_price = (high + low + close) / 3
+    money_flow = typical_price * volume
+    
+    tp_diff = _diff(typical_price)
+    positive_flow = np.where(tp_diff > 0, money_flow, 0.0)
+    negative_flow = np.where(tp_diff < 0, money_flow, 0.0)
+    
+    # First bar has no direction, so it stays NaN in both flows
+    no_direction = np.isnan(tp_diff)
+    positive_flow[no_direction] = np.nan
+    negative_flow[no_direction] = np.nan
+    
+    positive_sum, negative_sum = _rolling_pair(positive_flow, negative_flow, MFI_PERIOD, how='sum')
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        money_flow_ratio = positive_sum / negative_sum
+        mfi = 100 - (100 / (1 + money_flow_ratio))
+    
+    crossover = (mfi > 50) & (_shift(mfi) <= 50)
+    
+    return {'MFI': mfi, 'MFI_Crossover': crossover.astype(np.int64)}
+
+def _volume_columns(volume):
+    """Volume moving averages and surge flag"""
+    volume_ma_short = _move_mean(volume, VOLUME_MA_SHORT)
+    
+    return {
+        'Volume_MA_Short': volume_ma_short,
+        'Volume_MA_Long': _move_mean(volume, VOLUME_MA_LONG),
+        'Volume_Surge': (volume > volume_ma_short * 1.5).astype(np.int64)
+    }
+
+def _column(df, name):
+    """Column as a float64 array for the indicator kernels"""
+    return df[name].to_numpy(dtype=np.float64)
 
 def calculate_macd(df):
-    """Calculate MACD indicator using pure pandas"""
+    """Calculate MACD indicator from the Close array and add its columns in place"""
     try:
-        close = df['Close']
-        
-        # Calculate EMAs
-        ema_fast = close.ewm(span=MACD_FAST).mean()
-        ema_slow = close.ewm(span=MACD_SLOW).mean()
-        
-        # MACD line
-        macd_line = ema_fast - ema_slow
-        
-        # Signal line (EMA of MACD)
-        signal_line = macd_line.ewm(span=MACD_SIGNAL).mean()
-        
-        # Histogram
-        histogram = macd_line - signal_line
-        
-        df['MACD'] = macd_line
-        df['MACD_Signal'] = signal_line
-        df['MACD_Histogram'] = histogram
-        
-        # Calculate crossover signals
-        df['MACD_Crossover'] = np.where(
-            (df['MACD'] > df['MACD_Signal']) & 
-            (df['MACD'].shift(1) <= df['MACD_Signal'].shift(1)), 
-            1, 0
-        )
+        for name, values in _macd_columns(_column(df, 'Close')).items():
+            df[name] = values
         
         return df
     except Exception as e:
@@ -37,73 +143,22 @@ def calculate_macd(df):
         return df
 
 def calculate_rsi(df):
-    """Calculate RSI indicator using pure pandas"""
+    """Calculate RSI indicator from the Close array and add its columns in place"""
     try:
-        close = df['Close']
-        delta = close.diff()
-        
-        # Separate gains and losses
-        gain = delta.where(delta > 0, 0)
-        loss = -delta.where(delta < 0, 0)
+        for name, values in _rsi_columns(_column(df, 'Close')).items():
+            df[name] = values
         
-        # Calculate average gains and losses
-        avg_gain = gain.rolling(window=RSI_PERIOD).mean()
-        avg_loss = loss.rolling(window=RSI_PERIOD).mean()
-        
-        # Calculate RS and RSI
-        rs = avg_gain / avg_loss
-        rsi = 100 - (100 / (1 + rs))
-        
-        df['RSI'] = rsi
         return df
     except Exception as e:
         print(f"Error calculating RSI: {str(e)}")
         return df
 
 def calculate_mfi(df):
-    """Calculate Money Flow Index using pure pandas"""
+    """Calculate Money Flow Index from the OHLCV arrays and add its columns in place"""
     try:
-        high = df['High']
-        low = df['Low']
-        close = df['Close']
-        volume = df['Volume']
-        
-        # Calculate typical price
-        typical_price = (high + low + close) / 3
-        
-        # Calculate money flow
-        money_flow = typical_price * volume
-        
-        # Calculate positive and negative money flows
-        positive_flow = pd.Series(index=df.index, dtype=float)
-        negative_flow = pd.Series(index=df.index, dtype=float)
-        
-        for i in range(1, len(df)):
-            if typical_price.iloc[i] > typical_price.iloc[i-1]:
-                positive_flow.iloc[i] = money_flow.iloc[i]
-                negative_flow.iloc[i] = 0
-            elif typical_price.iloc[i] < typical_price.iloc[i-1]:
-                positive_flow.iloc[i] = 0
-                negative_flow.iloc[i] = money_flow.iloc[i]
-            else:
-                positive_flow.iloc[i] = 0
-                negative_flow.iloc[i] = 0
-        
-        # Calculate 14-period sums
-        positive_flow_sum = positive_flow.rolling(window=MFI_PERIOD).sum()
-        negative_flow_sum = negative_flow.rolling(window=MFI_PERIOD).sum()
-        
-        # Calculate money flow ratio and MFI
-        money_flow_ratio = positive_flow_sum / negative_flow_sum
-        mfi = 100 - (100 / (1 + money_flow_ratio))
-        
-        df['MFI'] = mfi
-        
-        # Calculate MFI crossover signals (above 50 line)
-        df['MFI_Crossover'] = np.where(
-            (df['MFI'] > 50) & (df['MFI'].shift(1) <= 50), 
-            1, 0
-        )
+        columns = _mfi_columns(_column(df, 'High'), _column(df, 'Low'), _column(df, 'Close'), _column(df, 'Volume'))
+        for name, values in columns.items():
+            df[name] = values
         
         return df
     except Exception as e:
@@ -113,35 +168,95 @@ def calculate_mfi(df):
 def calculate_volume_indicators(df):
     """Calculate volume-based indicators"""
     try:
-        df['Volume_MA_Short'] = df['Volume'].rolling(window=VOLUME_MA_SHORT).mean()
-        df['Volume_MA_Long'] = df['Volume'].rolling(window=VOLUME_MA_LONG).mean()
-        
-        # Volume surge detection
-        df['Volume_Surge'] = np.where(
-            df['Volume'] > df['Volume_MA_Short'] * 1.5, 1, 0
-        )
+        for name, values in _volume_columns(_column(df, 'Volume')).items():
+            df[name] = values
         
         return df
     except Exception as e:
         print(f"Error calculating volume indicators: {str(e)}")
         return df
 
-def calculate_all_indicators(df):
-    """Calculate all technical indicators"""
+def _indicator_columns(df, macd_state=None):
+    """All indicator columns for df as arrays"""
+    close = _column(df, 'Close')
+    volume = _column(df, 'Volume')
+    
+    return {
+        **_macd_columns(close, macd_state),
+        **_rsi_columns(close),
+        **_mfi_columns(_column(df, 'High'), _column(df, 'Low'), close, volume),
+        **_volume_columns(volume)
+    }
+
+def calculate_all_indicators(df, tail_only=False):
+    """Calculate all technical indicators, or with tail_only just for new bars appended without them"""
     if df.empty:
         return df
     
     try:
-        df = calculate_macd(df)
-        df = calculate_rsi(df)
-        df = calculate_mfi(df)
-        df = calculate_volume_indicators(df)
+        if tail_only and all(col in df.columns for col in ('EMA_Fast', 'EMA_Slow', 'MACD_Signal')):
+            # New bars are the trailing rows that have no indicator values yet
+            has_values = df['EMA_Fast'].notna().to_numpy()
+            n_new = len(df) - (np.flatnonzero(has_values)[-1] + 1) if has_values.any() else len(df)
+            
+            if n_new == 0:
+                return df
+            
+            if n_new + INDICATOR_LOOKBACK < len(df):
+                # EMAs resume from the stored bar before the window, the window itself covers the rolling periods
+                start = len(df) - n_new - INDICATOR_LOOKBACK
+                macd_state = df.iloc[start - 1][['EMA_Fast', 'EMA_Slow', 'MACD_Signal']].to_dict()
+                window = df.iloc[start:].assign(**_indicator_columns(df.iloc[start:], macd_state))
+                
+                # Frames saved before an indicator column was added need it for every bar
+                if window.columns.isin(df.columns).all():
+                    # Appending bars without indicators turned the flag columns into floats, restore them
+                    return pd.concat([df.iloc[:-n_new], window.iloc[-n_new:]]).astype(window.dtypes.to_dict())
         
-        return df
+        # Columns are built from raw arrays and attached in a single assign
+        return df.assign(**_indicator_columns(df))
     except Exception as e:
         print(f"Error calculating indicators: {str(e)}")
         return df
 
+def calculate_indicators_batch(frames):
+    """Calculate all technical indicators for a dict of stocks in one pass"""
+    results = dict(frames)
+    valid = {symbol: df for symbol, df in frames.items() if not df.empty}
+    
+    if not valid:
+        return results
+    
+    try:
+        # Right-align every stock on a (bars x symbols) grid, shorter histories are
+        # NaN-padded at the start which leaves their indicator values unchanged
+        n_bars = max(len(df) for df in valid.values())
+        
+        def stack(name):
+            grid = np.full((n_bars, len(valid)), np.nan)
+            for j, df in enumerate(valid.values()):
+                grid[n_bars - len(df):, j] = _column(df, name)
+            return grid
+        
+        close = stack('Close')
+        volume = stack('Volume')
+        
+        columns = {
+            **_macd_columns(close),
+            **_rsi_columns(close),
+            **_mfi_columns(stack('High'), stack('Low'), close, volume),
+            **_volume_columns(volume)
+        }
+        
+        for j, (symbol, df) in enumerate(valid.items()):
+            start = n_bars - len(df)
+            results[symbol] = df.assign(**{name: values[start:, j] for name, values in columns.items()})
+        
+        return results
+    except Exception as e:
+        print(f"Error calculating batch indicators: {str(e)}")
+        return {symbol: calculate_all_indicators(df) for symbol, df in frames.items()}
+
 def get_latest_signals(df):
     """Get latest crossover signals"""
     if df.empty or len(df) < 2:
@@ -167,6 +282,21 @@ def get_latest_signals(df):
         'timestamp': latest.name if hasattr(latest, 'name') else None
     }
 
+def _crossover_flags(df):
+    """MACD, MFI and RSI crossover flags for the last bar"""
+    latest = df.iloc[-1]
+    
+    if all(col in df.columns for col in ('MACD_Crossover', 'MFI_Crossover', 'RSI_OS_Recovery')):
+        return bool(latest['MACD_Crossover']), bool(latest['MFI_Crossover']), bool(latest['RSI_OS_Recovery'])
+    
+    # Frames saved before the flag columns existed are compared bar to bar
+    previous = df.iloc[-2]
+    return (
+        latest.get('MACD', 0) > latest.get('MACD_Signal', 0) and previous.get('MACD', 0) <= previous.get('MACD_Signal', 0),
+        latest.get('MFI', 0) > 50 and previous.get('MFI', 0) <= 50,
+        latest.get('RSI', 0) > 30 and previous.get('RSI', 0) <= 30
+    )
+
 def detect_crossover_signals(df):
     """Detect all types of crossover signals"""
     signals = []
@@ -174,36 +304,40 @@ def detect_crossover_signals(df):
     if df.empty or len(df) < 2:
         return signals
     
-    latest = df.iloc[-1]
-    previous = df.iloc[-2]
+    macd_crossover, mfi_crossover, rsi_recovery = _crossover_flags(df)
+    
+    if not (macd_crossover or mfi_crossover or rsi_recovery):
+        return signals
+    
+    latest = df.iloc[-1].to_dict()
+    timestamp = df.index[-1]
     
     # MACD bullish crossover
-    if (latest.get('MACD', 0) > latest.get('MACD_Signal', 0) and 
-        previous.get('MACD', 0) <= previous.get('MACD_Signal', 0)):
+    if macd_crossover:
         signals.append({
             'type': 'MACD_BULLISH_CROSSOVER',
             'value': latest.get('MACD', 0),
             'signal_value': latest.get('MACD_Signal', 0),
-            'timestamp': latest.name if hasattr(latest, 'name') else None
+            'timestamp': timestamp
         })
     
     # MFI bullish crossover (crossing above 50)
-    if (latest.get('MFI', 0) > 50 and previous.get('MFI', 0) <= 50):
+    if mfi_crossover:
         signals.append({
             'type': 'MFI_BULLISH_CROSSOVER',
             'value': latest.get('MFI', 0),
             'signal_value': 50,
-            'timestamp': latest.name if hasattr(latest, 'name') else None
+            'timestamp': timestamp
         })
     
     # Additional signals can be added here
     # RSI oversold recovery
-    if (latest.get('RSI', 0) > 30 and previous.get('RSI', 0) <= 30):
+    if rsi_recovery:
         signals.append({
             'type': 'RSI_OVERSOLD_RECOVERY',
             'value': latest.get('RSI', 0),
             'signal_value': 30,
-            'timestamp': latest.name if hasattr(latest, 'name') else None
+            'timestamp': timestamp
         })
     
     return signals
@@ -213,30 +347,46 @@ def get_indicator_summary(df):
     if df.empty:
         return {}
     
-    latest = df.iloc[-1]
+    # Read each row once as plain Python values instead of boxing a scalar per lookup
+    latest = df.iloc[-1].to_dict()
+    previous = df.iloc[-2].to_dict() if len(df) > 1 else None
+    
+    close = latest.get('Close', 0)
+    macd = latest.get('MACD', 0)
+    rsi = latest.get('RSI', 0)
+    mfi = latest.get('MFI', 0)
+    
+    if previous is not None:
+        previous_close = previous.get('Close', 1)
+        change = close - previous.get('Close', 0)
+        # Plain floats raise on a zero close where NumPy gave inf/NaN, report no percentage instead
+        change_pct = change / previous_close * 100 if previous_close else np.nan
+    else:
+        change = 0
+        change_pct = 0
     
     summary = {
         'price': {
-            'current': latest.get('Close', 0),
-            'change': latest.get('Close', 0) - df.iloc[-2].get('Close', 0) if len(df) > 1 else 0,
-            'change_pct': ((latest.get('Close', 0) - df.iloc[-2].get('Close', 0)) / df.iloc[-2].get('Close', 1) * 100) if len(df) > 1 else 0
+            'current': close,
+            'change': change,
+            'change_pct': change_pct
         },
         'macd': {
             'value': latest.get('MACD', None),
             'signal': latest.get('MACD_Signal', None),
             'histogram': latest.get('MACD_Histogram', None),
-            'bullish': latest.get('MACD', 0) > latest.get('MACD_Signal', 0)
+            'bullish': macd > latest.get('MACD_Signal', 0)
         },
         'rsi': {
             'value': latest.get('RSI', None),
-            'overbought': latest.get('RSI', 0) > 70,
-            'oversold': latest.get('RSI', 0) < 30
+            'overbought': rsi > 70,
+            'oversold': rsi < 30
         },
         'mfi': {
             'value': latest.get('MFI', None),
-            'overbought': latest.get('MFI', 0) > 80,
-            'oversold': latest.get('MFI', 0) < 20,
-            'bullish': latest.get('MFI', 0) > 50
+            'overbought': mfi > 80,
+            'oversold': mfi < 20,
+            'bullish': mfi > 50
         },
         'volume': {
             'current': latest.get('Volume', 0),
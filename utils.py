@@ -1,72 +1,397 @@
 import os
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta
 import json
 import time
+import random
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from config import REQUEST_RATE, REQUEST_BURST, RATE_LIMIT_RETRIES, MAX_WORKERS, NIFTY_100_SYMBOLS
+
+STOCK_INDEX_PATH = "stock_data/index.parquet"
+ALERT_LOG_PATH = "stock_data/alerts/alert_log.jsonl"
+LEGACY_ALERT_LOG_PATH = "stock_data/alerts/alert_log.json"
+_stock_index_lock = threading.Lock()
+# Reentrant since clean_old_alerts rewrites the log through save_alert_log
+_alert_log_lock = threading.RLock()
 
 def create_data_folder():
     """Create data folder if it doesn't exist"""
-    if not os.path.exists("stock_data"):
-        os.makedirs("stock_data")
-    if not os.path.exists("stock_data/historical"):
-        os.makedirs("stock_data/historical")
-    if not os.path.exists("stock_data/alerts"):
-        os.makedirs("stock_data/alerts")
-
-def get_file_path(symbol, data_type="historical"):
+    os.makedirs("stock_data/historical", exist_ok=True)
+    os.makedirs("stock_data/alerts", exist_ok=True)
+
+def display_symbol(symbol):
+    """Get symbol without the exchange suffix for display"""
+    return symbol.removesuffix('.NS')
+
+def get_file_path(symbol, data_type="historical", extension="parquet"):
     """Get file path for stock data"""
-    return f"stock_data/{data_type}/{symbol.replace('.NS', '')}.csv"
+    return f"stock_data/{data_type}/{display_symbol(symbol)}.{extension}"
+
+@functools.lru_cache(maxsize=256)
+def _read_stock_file(file_path, mtime_ns):
+    """Read stock data file, cached per file path and modification time"""
+    df = pd.read_parquet(file_path, engine='pyarrow')
+    return downcast_numeric(df)
+
+def downcast_numeric(df):
+    """Downcast float64 columns to float32 and integer columns to the smallest safe type"""
+    dtypes = {col: 'float32' for col in df.select_dtypes('float64').columns}
+    
+    for col in df.select_dtypes('integer').columns:
+        dtype = pd.to_numeric(df[col], downcast='integer').dtype
+        if dtype != df[col].dtype:
+            dtypes[col] = dtype
+    
+    # Returns a new frame so the caller's frame keeps its dtypes
+    return df.astype(dtypes) if dtypes else df
+
+def _report_error(message, errors=None):
+    """Collect a message for a caller on a worker thread, or show it right away"""
+    # Worker threads have no Streamlit context, so their callers show the message
+    if errors is not None:
+        errors.append(message)
+    else:
+        st.error(message)
 
-def load_stock_data(symbol):
-    """Load stock data from CSV file"""
+def _migrate_csv_data(symbol, errors=None):
+    """Convert stock data saved as CSV by older versions to Parquet"""
+    try:
+        df = pd.read_csv(get_file_path(symbol, extension="csv"), index_col=0, parse_dates=True)
+    except FileNotFoundError:
+        return False
+    
+    return save_stock_data(symbol, df, errors=errors)
+
+def load_stock_data(symbol, errors=None):
+    """Load stock data from Parquet file"""
     file_path = get_file_path(symbol)
     try:
-        if os.path.exists(file_path):
-            df = pd.read_csv(file_path, index_col=0, parse_dates=True)
-            return df
-        return pd.DataFrame()
+        try:
+            mtime_ns = os.stat(file_path).st_mtime_ns
+        except FileNotFoundError:
+            if not _migrate_csv_data(symbol, errors):
+                return pd.DataFrame()
+            mtime_ns = os.stat(file_path).st_mtime_ns
+        
+        # mtime is part of the cache key so freshly saved data is never stale,
+        # callers get a copy since several of them add columns in place
+        return _read_stock_file(file_path, mtime_ns).copy()
     except Exception as e:
-        st.error(f"Error loading data for {symbol}: {str(e)}")
+        _report_error(f"Error loading data for {symbol}: {str(e)}", errors)
         return pd.DataFrame()
 
-def save_stock_data(symbol, df):
-    """Save stock data to CSV file"""
+def stock_file_mtime(symbol):
+    """Get the modification time of a stock's data file in nanoseconds, or None when missing"""
+    try:
+        return os.stat(get_file_path(symbol)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def load_many_stocks(symbols):
+    """Load stock data for several symbols in parallel"""
+    errors = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        frames = dict(zip(symbols, executor.map(lambda symbol: load_stock_data(symbol, errors), symbols)))
+    
+    for message in errors:
+        st.error(message)
+    
+    return frames
+
+def _read_parquet_tail(file_path, cols, n):
+    """Read the last n rows of some columns from the trailing row groups, plus the total row count"""
+    parquet_file = pq.ParquetFile(file_path)
+    
+    row_groups = []
+    rows = 0
+    for i in reversed(range(parquet_file.num_row_groups)):
+        row_groups.insert(0, i)
+        rows += parquet_file.metadata.row_group(i).num_rows
+        if rows >= n:
+            break
+    
+    if not row_groups:
+        return pd.DataFrame(columns=list(cols)), 0
+    
+    # Pandas metadata restores the DatetimeIndex alongside the requested columns
+    table = parquet_file.read_row_groups(row_groups, columns=list(cols), use_pandas_metadata=True)
+    return table.to_pandas().iloc[-n:], parquet_file.metadata.num_rows
+
+def save_stock_data(symbol, df, update_index=True, errors=None):
+    """Save stock data to Parquet file"""
     file_path = get_file_path(symbol)
     try:
-        df.to_csv(file_path)
+        # float32 prices and indicators are plenty for display and halve the file size
+        downcast_numeric(df).to_parquet(file_path, engine='pyarrow', compression='snappy')
+        if update_index:
+            update_stock_index(symbol, df)
         return True
     except Exception as e:
-        st.error(f"Error saving data for {symbol}: {str(e)}")
+        _report_error(f"Error saving data for {symbol}: {str(e)}", errors)
         return False
 
+def _stock_index_row(df, records=None):
+    """Summary row kept in the stock index for one symbol"""
+    # Timestamps are stored as ISO strings so symbols with different offsets share a column
+    return {
+        'last_ts': df.index[-1].isoformat(),
+        'records': len(df) if records is None else records,
+        'last_close': float(df['Close'].iloc[-1])
+    }
+
+def _write_stock_index(index):
+    """Atomically replace the stock index file"""
+    tmp_path = f"{STOCK_INDEX_PATH}.tmp"
+    index.to_parquet(tmp_path, engine='pyarrow')
+    os.replace(tmp_path, STOCK_INDEX_PATH)
+
+@functools.lru_cache(maxsize=4)
+def _read_stock_index(file_path, mtime_ns):
+    """Read the stock index file, cached per modification time"""
+    index = pd.read_parquet(file_path, engine='pyarrow')
+    index['last_ts'] = index['last_ts'].map(pd.Timestamp)
+    return index
+
+def _scan_stock_files():
+    """Index rows for every saved Parquet stock file, read directly without CSV migration"""
+    rows = {}
+    for symbol in NIFTY_100_SYMBOLS:
+        try:
+            tail, records = _read_parquet_tail(get_file_path(symbol), ('Close',), 1)
+        except FileNotFoundError:
+            continue
+        
+        if not tail.empty:
+            rows[symbol] = _stock_index_row(tail, records)
+    
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['last_ts', 'records', 'last_close'])
+
+def update_stock_index(symbol, df):
+    """Upsert one symbol's last timestamp, record count and last close into the stock index"""
+    with _stock_index_lock:
+        try:
+            index = pd.read_parquet(STOCK_INDEX_PATH, engine='pyarrow')
+        except FileNotFoundError:
+            # First save since the index was introduced, pick up files saved before it
+            index = _scan_stock_files()
+        
+        if df.empty:
+            index = index.drop(symbol, errors='ignore')
+        else:
+            index.loc[symbol] = _stock_index_row(df)
+        
+        _write_stock_index(index)
+
+def rebuild_stock_index():
+    """Rebuild the stock index from the saved stock files"""
+    # Convert legacy CSV files first so the scan picks them up
+    for symbol in NIFTY_100_SYMBOLS:
+        if stock_file_mtime(symbol) is None:
+            _migrate_csv_data(symbol)
+    
+    index = _scan_stock_files()
+    
+    with _stock_index_lock:
+        _write_stock_index(index)
+
+def load_stock_index():
+    """Load per-symbol last timestamp, record count and last close without reading every stock file"""
+    try:
+        try:
+            mtime_ns = os.stat(STOCK_INDEX_PATH).st_mtime_ns
+        except FileNotFoundError:
+            rebuild_stock_index()
+            mtime_ns = os.stat(STOCK_INDEX_PATH).st_mtime_ns
+        
+        return _read_stock_index(STOCK_INDEX_PATH, mtime_ns)
+    except Exception as e:
+        st.error(f"Error loading stock index: {str(e)}")
+        return pd.DataFrame(columns=['last_ts', 'records', 'last_close'])
+
+def resample_ohlcv(df, hours=4):
+    """Aggregate OHLCV bars into fixed hour buckets aligned to local midnight"""
+    columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    
+    # Bucket on local wall time, which is how pandas anchors '4H' bins for tz-aware data
+    index = df.index.as_unit('ns')
+    wall_ns = (index.tz_localize(None) if index.tz is not None else index).asi8
+    bucket_ns = hours * 3600 * 1_000_000_000
+    buckets = wall_ns // bucket_ns
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    
+    def first_valid(values):
+        positions = np.where(np.isnan(values), len(values), np.arange(len(values)))
+        first = np.minimum.reduceat(positions, starts)
+        return np.where(first < len(values), values[np.minimum(first, len(values) - 1)], np.nan)
+    
+    def last_valid(values):
+        positions = np.where(np.isnan(values), -1, np.arange(len(values)))
+        last = np.maximum.reduceat(positions, starts)
+        return np.where(last >= 0, values[last], np.nan)
+    
+    volume = df['Volume'].to_numpy()
+    if volume.dtype.kind == 'f':
+        volume = np.nan_to_num(volume)
+    
+    bars = pd.DataFrame({
+        'Open': first_valid(df['Open'].to_numpy(dtype=np.float64)),
+        'High': np.fmax.reduceat(df['High'].to_numpy(dtype=np.float64), starts),
+        'Low': np.fmin.reduceat(df['Low'].to_numpy(dtype=np.float64), starts),
+        'Close': last_valid(df['Close'].to_numpy(dtype=np.float64)),
+        'Volume': np.add.reduceat(volume, starts)
+    }, index=pd.DatetimeIndex(buckets[starts] * bucket_ns).tz_localize(index.tz))
+    
+    return bars.dropna()
+
+def _migrate_alert_log():
+    """Convert the JSON alert log written by older versions to JSON Lines"""
+    try:
+        with open(LEGACY_ALERT_LOG_PATH, 'r') as f:
+            alerts = json.load(f)
+    except FileNotFoundError:
+        return False
+    
+    if not save_alert_log(alerts):
+        return False
+    
+    os.remove(LEGACY_ALERT_LOG_PATH)
+    return True
+
+def iter_alert_log():
+    """Stream alerts from the JSON Lines log one record at a time"""
+    try:
+        f = open(ALERT_LOG_PATH, 'r')
+    except FileNotFoundError:
+        if not _migrate_alert_log():
+            return
+        f = open(ALERT_LOG_PATH, 'r')
+    
+    with f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A write cut short by a crash leaves a partial last line
+                continue
+
 def load_alert_log():
-    """Load alert log from JSON file"""
-    log_file = "stock_data/alerts/alert_log.json"
+    """Load alert log from JSON Lines file"""
     try:
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                return json.load(f)
-        return []
+        return list(iter_alert_log())
     except Exception as e:
         st.error(f"Error loading alert log: {str(e)}")
         return []
 
+def _alert_lines(alerts):
+    """Serialize alerts as JSON Lines"""
+    return ''.join(json.dumps(alert, separators=(',', ':'), default=str) + '\n' for alert in alerts)
+
+def append_alert_log(alerts):
+    """Append alerts to the JSON Lines log without rewriting earlier entries"""
+    try:
+        with _alert_log_lock, open(ALERT_LOG_PATH, 'a') as f:
+            f.write(_alert_lines(alerts))
+        return True
+    except Exception as e:
+        st.error(f"Error saving alert log: {str(e)}")
+        return False
+
 def save_alert_log(alerts):
-    """Save alert log to JSON file"""
-    log_file = "stock_data/alerts/alert_log.json"
+    """Replace the whole JSON Lines alert log"""
     try:
-        with open(log_file, 'w') as f:
-            json.dump(alerts, f, indent=2, default=str)
+        # Write to a temp file and swap it in so readers never see a partial log
+        tmp_file = f"{ALERT_LOG_PATH}.tmp"
+        with _alert_log_lock:
+            with open(tmp_file, 'w') as f:
+                f.write(_alert_lines(alerts))
+            os.replace(tmp_file, ALERT_LOG_PATH)
         return True
     except Exception as e:
         st.error(f"Error saving alert log: {str(e)}")
         return False
 
-def rate_limit_delay():
-    """Add delay to respect rate limits"""
-    time.sleep(0.5)
+class RateLimiter:
+    """Token bucket shared by all download threads that slows down when Yahoo answers with HTTP 429"""
+    
+    def __init__(self, rate_per_sec=REQUEST_RATE, burst=REQUEST_BURST):
+        self.base_rate = rate_per_sec
+        self.rate = rate_per_sec
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Take a token, sleeping only when the bucket is empty"""
+        # Tokens may go negative, which reserves a slot for this caller before sleeping outside the lock
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        
+        if wait > 0:
+            time.sleep(wait)
+    
+    def backoff(self):
+        """Double the refill interval and empty the bucket, returning a jittered pause"""
+        with self.lock:
+            self.rate = max(self.rate / 2, self.base_rate / 64)
+            self.tokens = min(self.tokens, 0.0)
+            return random.uniform(1, 2) / self.rate
+    
+    def record_success(self):
+        """Recover the refill rate after successful requests"""
+        with self.lock:
+            self.rate = min(self.rate * 2, self.base_rate)
+
+_rate_limiter = RateLimiter()
+
+def _is_rate_limited(error):
+    """Whether a yfinance error is an HTTP 429 response"""
+    message = str(error)
+    return type(error).__name__ == 'YFRateLimitError' or '429' in message or 'Too Many Requests' in message
+
+def is_no_data_error(error):
+    """Whether a yfinance error only means the symbol returned no prices"""
+    message = str(error).lower()
+    return (
+        type(error).__name__ in ('YFPricesMissingError', 'YFTzMissingError')
+        or 'delisted' in message or 'no data found' in message or 'no price data found' in message
+    )
+
+def rate_limited_request(func, *args, retry_if=None, **kwargs):
+    """Call a Yahoo Finance request through the shared rate limiter, backing off and retrying on HTTP 429"""
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        _rate_limiter.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if attempt == RATE_LIMIT_RETRIES or not _is_rate_limited(e):
+                raise
+            time.sleep(_rate_limiter.backoff())
+        else:
+            # Some calls such as yf.download don't raise on a 429 but return empty or partial
+            # results, retry_if spots those so they back off too
+            if retry_if is not None and attempt < RATE_LIMIT_RETRIES and retry_if(result):
+                time.sleep(_rate_limiter.backoff())
+                continue
+            
+            _rate_limiter.record_success()
+            return result
 
 def format_number(value, decimals=2):
     """Format number for display"""
@@ -95,22 +420,33 @@ def validate_email_config():
         return False, "No email recipients configured"
     return True, "Email configuration valid"
 
-def clean_old_alerts(days=7):
-    """Clean alerts older than specified days"""
-    alerts = load_alert_log()
+def clean_old_alerts(days=7, min_dropped=1):
+    """Clean alerts older than specified days, rewriting the log only when at least min_dropped are removed"""
     cutoff_date = datetime.now() - timedelta(days=days)
     
-    cleaned_alerts = [
-        alert for alert in alerts
-        if datetime.fromisoformat(alert.get('timestamp', '1970-01-01')) > cutoff_date
-    ]
-    
-    save_alert_log(cleaned_alerts)
-    return len(alerts) - len(cleaned_alerts)
+    # Single streaming pass, the log is only rewritten when enough alerts expire. The lock
+    # keeps appends from any session out until the rewrite is done
+    with _alert_log_lock:
+        kept_alerts = []
+        dropped = 0
+        for alert in iter_alert_log():
+            alert_time = datetime.fromisoformat(alert.get('timestamp', '1970-01-01'))
+            if alert_time.tzinfo is not None:
+                # Bar timestamps carry the exchange offset, compare them in local time
+                alert_time = alert_time.astimezone().replace(tzinfo=None)
+            
+            if alert_time > cutoff_date:
+                kept_alerts.append(alert)
+            else:
+                dropped += 1
+        
+        if dropped >= min_dropped:
+            save_alert_log(kept_alerts)
+        return dropped
 
 def get_stock_status_summary():
     """Get summary of stock data status"""
-    from config import NIFTY_100_SYMBOLS
+    index = load_stock_index()
     
     status = {
         'total_stocks': len(NIFTY_100_SYMBOLS),
@@ -120,11 +456,11 @@ def get_stock_status_summary():
     }
     
     for symbol in NIFTY_100_SYMBOLS:
-        df = load_stock_data(symbol)
-        if not df.empty:
+        if symbol in index.index:
+            last_ts = index.at[symbol, 'last_ts']
             status['data_available'] += 1
-            if status['last_updated'] is None or df.index[-1] > pd.to_datetime(status['last_updated']):
-                status['last_updated'] = df.index[-1]
+            if status['last_updated'] is None or last_ts > pd.to_datetime(status['last_updated']):
+                status['last_updated'] = last_ts
         else:
             status['missing_data'].append(symbol)
     